@@ -1,7 +1,13 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import logging
 import os
+import shutil
+from pathlib import Path
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from ui_components import (
     load_css, set_theme, apply_color_scheme, display_data_profiling,
     display_download_section, display_analytics_templates, display_automl_section,
@@ -24,9 +30,57 @@ st.set_page_config(
 load_css()
 set_theme()
 
+log = logging.getLogger(__name__)
+
 # Constants
 UPLOAD_DIR = "uploaded_datasets"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+@st.cache_resource
+def _ensure_upload_dir():
+    """Create the upload directory once per process rather than on every rerun"""
+    upload_dir = Path(UPLOAD_DIR)
+    upload_dir.mkdir(exist_ok=True)
+    return upload_dir
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _load_dataset_cached(file_id, _file_path):
+    """Parse the saved upload once per file_id instead of on every rerun"""
+    return load_dataset(_file_path)
+
+@st.cache_resource
+def _get_http():
+    """Keep-alive HTTP session and background executor shared across reruns"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return session, ThreadPoolExecutor(max_workers=2)
+
+@st.cache_data(show_spinner=False)
+def _preview_arrow(df_key, _df):
+    """Arrow table for the dataset preview, converted once per dataset"""
+    return pa.Table.from_pandas(_df.head())
+
+def _preview_key(df):
+    """Cheap cache key for the preview: shape, column names and a hash of the rows shown"""
+    row_hashes = pd.util.hash_pandas_object(df.head())
+    return (len(df), tuple(df.columns), tuple(int(h) for h in row_hashes))
+
+class _GenerationError(Exception):
+    """Raised for LLM errors so that they are not stored in the cache"""
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _generate_code_cached(question, columns, _api_key):
+    """Generate and clean code once per (question, columns) instead of on every rerun"""
+    result = generate_code_with_llm(question, ", ".join(columns), _api_key)
+    if "error" in result:
+        raise _GenerationError(result["error"])
+    return clean_generated_code(result.get("code", ""))
+
+def _report_dataset_log(future):
+    """Log a failed background dataset-log request (st.* can't be called from the worker thread)"""
+    try:
+        future.result().raise_for_status()
+    except Exception as e:
+        log.warning("Could not log dataset: %s", e)
 
 # Initialize session state
 if 'df' not in st.session_state:
@@ -107,29 +161,37 @@ def main():
         
         if uploaded_file is not None:
             # Save uploaded file
-            file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            file_path = str(_ensure_upload_dir() / uploaded_file.name)
+            # Only rewrite (and log) the file for a new upload, not on every rerun
+            new_upload = st.session_state.get('uploaded_file_id') != uploaded_file.file_id
+            if new_upload:
+                uploaded_file.seek(0)
+                with open(file_path, "wb") as f:
+                    shutil.copyfileobj(uploaded_file, f, 1 << 20)
+                uploaded_file.seek(0)
+                st.session_state.uploaded_file_id = uploaded_file.file_id
             
             # Load dataset
-            df = load_dataset(file_path)
+            df = _load_dataset_cached(uploaded_file.file_id, file_path)
             if df is not None:
                 st.session_state.df = df
                 st.session_state.current_dataset = file_path
                 
-                # Log to database
-                try:
-                    response = requests.post(
+                if new_upload:
+                    # Log to database in the background so the UI doesn't wait on it
+                    http, executor = _get_http()
+                    future = executor.submit(
+                        http.post,
                         "http://fastapi:8000/log_dataset/",
                         json={
                             "filename": uploaded_file.name,
                             "file_path": file_path,
                             "rows": len(df),
                             "columns": len(df.columns)
-                        }
+                        },
+                        timeout=2
                     )
-                except Exception as e:
-                    st.warning(f"Could not log dataset: {str(e)}")
+                    future.add_done_callback(_report_dataset_log)
                 
                 st.success(f"✅ Dataset loaded successfully! {len(df)} rows, {len(df.columns)} columns")
             else:
@@ -146,7 +208,8 @@ def main():
             
             # Show first few rows
             st.markdown("### 📋 Preview")
-            st.dataframe(st.session_state.df.head(), use_container_width=True)
+            preview = _preview_arrow(_preview_key(st.session_state.df), st.session_state.df)
+            st.dataframe(preview, use_container_width=True)
     
     # Main analysis section
     if st.session_state.df is not None:
@@ -172,14 +235,13 @@ def main():
                 return
             
             # Generate code
-            columns = ", ".join(st.session_state.df.columns)
-            result = generate_code_with_llm(user_question, columns, api_key)
-            
-            if "error" in result:
-                st.error(f"❌ {result['error']}")
+            try:
+                cleaned_code = _generate_code_cached(
+                    user_question, tuple(st.session_state.df.columns), api_key
+                )
+            except _GenerationError as e:
+                st.error(f"❌ {str(e)}")
             else:
-                cleaned_code = clean_generated_code(result.get("code", ""))
-                
                 # Display generated code
                 with st.expander("🔍 Generated Code", expanded=False):
                     st.code(cleaned_code, language="python")
@@ -1,54 +1,88 @@
 # database_service.py
 
 import time
-import json
+import orjson
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.orm import Session
-from db import SessionLocal
+from db import SessionScoped
 from models import QueryLog, Dataset, AnalysisResult, DatasetHistory
 
+# Built once so SQLAlchemy's compiled-statement cache is hit on every log_query call
+_LOG_QUERY_INSERT = insert(QueryLog).returning(QueryLog.id)
+
 def get_db():
     """Get database session"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    with DatabaseService() as service:
+        yield service.db
 
 class DatabaseService:
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db: Session = None):
+        # Use an injected session when given (e.g. a FastAPI dependency), else the thread's scoped one
+        self._owns_scoped = db is None
+        self.db = SessionScoped() if self._owns_scoped else db
+        if self._owns_scoped:
+            # Count the services sharing the scoped session so only the last one to close removes it
+            self.db.info["service_count"] = self.db.info.get("service_count", 0) + 1
     
     def __enter__(self):
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.db.close()
+        self.close()
+    
+    def close(self):
+        """Release the scoped session; injected sessions are closed by whoever injected them"""
+        if not self._owns_scoped:
+            return
+        self._owns_scoped = False
+        self.db.info["service_count"] -= 1
+        if self.db.info["service_count"] == 0:
+            SessionScoped.remove()
+    
+    @contextmanager
+    def transaction(self):
+        """Group several writes into a single commit, rolling back on error.
+        The depth lives on the session, so nested blocks - from this or any other
+        service sharing the session - only flush and the outermost one commits."""
+        depth = self.db.info.get("transaction_depth", 0)
+        self.db.info["transaction_depth"] = depth + 1
+        try:
+            yield self
+            if depth:
+                self.db.flush()
+            else:
+                self.db.commit()
+        except Exception:
+            if not depth:
+                self.db.rollback()
+            raise
+        finally:
+            self.db.info["transaction_depth"] = depth
     
     def log_query(self, question: str, generated_code: str, dataset_name: str = None, 
                   dataset_columns: List[str] = None) -> int:
         """Log a query to the database"""
-        query_log = QueryLog(
-            question=question,
-            generated_code=generated_code,
-            dataset_name=dataset_name,
-            dataset_columns=json.dumps(dataset_columns) if dataset_columns else None
-        )
-        self.db.add(query_log)
-        self.db.commit()
-        self.db.refresh(query_log)
-        return query_log.id
+        with self.transaction():
+            query_id = self.db.execute(_LOG_QUERY_INSERT, {
+                "question": question,
+                "generated_code": generated_code,
+                "dataset_name": dataset_name,
+                "dataset_columns": orjson.dumps(dataset_columns).decode() if dataset_columns else None
+            }).scalar_one()
+        return query_id
     
     def update_query_execution(self, query_id: int, execution_output: str = None, 
                               success: bool = True, execution_time: float = None):
         """Update query execution results"""
-        query_log = self.db.query(QueryLog).filter(QueryLog.id == query_id).first()
-        if query_log:
-            query_log.execution_output = execution_output
-            query_log.execution_success = 1 if success else 0
-            query_log.execution_time = execution_time
-            self.db.commit()
+        with self.transaction():
+            query_log = self.db.query(QueryLog).filter(QueryLog.id == query_id).first()
+            if query_log:
+                query_log.execution_output = execution_output
+                query_log.execution_success = 1 if success else 0
+                query_log.execution_time = execution_time
     
     def log_analysis_result(self, query_id: int, result_type: str, result_data: str = None, 
                            plot_filename: str = None):
@@ -59,20 +93,22 @@ class DatabaseService:
             result_data=result_data,
             plot_filename=plot_filename
         )
-        self.db.add(result)
-        self.db.commit()
+        with self.transaction():
+            self.db.add(result)
     
     def store_dataset(self, name: str, filename: str, columns: List[str], row_count: int):
         """Store dataset information"""
         dataset = Dataset(
             name=name,
             filename=filename,
-            columns=json.dumps(columns),
+            columns=orjson.dumps(columns).decode(),
             row_count=row_count
         )
-        self.db.add(dataset)
-        self.db.commit()
-        return dataset.id
+        with self.transaction():
+            self.db.add(dataset)
+            self.db.flush()
+            dataset_id = dataset.id
+        return dataset_id
     
     def get_recent_queries(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent queries"""
@@ -81,7 +117,7 @@ class DatabaseService:
             {
                 "id": q.id,
                 "question": q.question,
-                "timestamp": q.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                "timestamp": q.timestamp.isoformat(sep=" ", timespec="seconds"),
                 "success": bool(q.execution_success),
                 "dataset_name": q.dataset_name
             }
@@ -103,7 +139,7 @@ class DatabaseService:
             "execution_output": query.execution_output,
             "success": bool(query.execution_success),
             "execution_time": query.execution_time,
-            "timestamp": query.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp": query.timestamp.isoformat(sep=" ", timespec="seconds"),
             "dataset_name": query.dataset_name,
             "results": [
                 {
@@ -123,19 +159,24 @@ class DatabaseService:
                 "id": d.id,
                 "name": d.name,
                 "filename": d.filename,
-                "columns": json.loads(d.columns) if d.columns else [],
+                "columns": orjson.loads(d.columns) if d.columns else [],
                 "row_count": d.row_count,
-                "upload_timestamp": d.upload_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                "last_used": d.last_used.strftime("%Y-%m-%d %H:%M:%S") if d.last_used else None
+                "upload_timestamp": d.upload_timestamp.isoformat(sep=" ", timespec="seconds"),
+                "last_used": d.last_used.isoformat(sep=" ", timespec="seconds") if d.last_used else None
             }
             for d in datasets
         ]
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get database statistics"""
-        total_queries = self.db.query(QueryLog).count()
-        successful_queries = self.db.query(QueryLog).filter(QueryLog.execution_success == 1).count()
-        total_datasets = self.db.query(Dataset).count()
+        # All three counters in a single round-trip
+        total_queries, successful_queries, total_datasets = self.db.execute(
+            select(
+                func.count(QueryLog.id),
+                func.count(QueryLog.id).filter(QueryLog.execution_success == 1),
+                select(func.count(Dataset.id)).scalar_subquery()
+            )
+        ).one()
         
         return {
             "total_queries": total_queries,
@@ -147,18 +188,21 @@ class DatabaseService:
     def add_dataset_to_history(self, name: str, filename: str, columns: List[str] = None, 
                               row_count: int = None) -> int:
         """Add or update dataset in history. Never add a new row for the same filename."""
-        try:
+        with self.transaction():
             # Check if dataset already exists (by filename)
-            existing = self.db.query(DatasetHistory).filter(
+            existing_id = self.db.query(DatasetHistory.id).filter(
                 DatasetHistory.filename == filename
-            ).first()
+            ).limit(1).scalar()
             
-            if existing:
+            if existing_id is not None:
                 # Only update last_used and usage_count
-                existing.last_used = datetime.utcnow()
-                existing.usage_count += 1
-                self.db.commit()
-                return existing.id
+                self.db.query(DatasetHistory).filter(
+                    DatasetHistory.id == existing_id
+                ).update({
+                    DatasetHistory.last_used: datetime.utcnow(),
+                    DatasetHistory.usage_count: DatasetHistory.usage_count + 1
+                }, synchronize_session=False)
+                return existing_id
             else:
                 # Add new entry
                 dataset = DatasetHistory(
@@ -168,12 +212,8 @@ class DatabaseService:
                     row_count=row_count
                 )
                 self.db.add(dataset)
-                self.db.commit()
-                self.db.refresh(dataset)
+                self.db.flush()
                 return dataset.id
-        except Exception as e:
-            self.db.rollback()
-            raise e
 
     def get_dataset_history(self, limit: int = 10) -> List[Dict]:
         """Get recent dataset history"""
@@ -224,23 +264,19 @@ class DatabaseService:
 
     def toggle_favorite(self, dataset_id: int) -> bool:
         """Toggle favorite status of a dataset"""
-        try:
+        with self.transaction():
             dataset = self.db.query(DatasetHistory).filter(
                 DatasetHistory.id == dataset_id
             ).first()
             
             if dataset:
                 dataset.is_favorite = not dataset.is_favorite
-                self.db.commit()
                 return dataset.is_favorite
             return False
-        except Exception as e:
-            self.db.rollback()
-            raise e
 
     def update_dataset_usage(self, dataset_id: int):
         """Update last used time and usage count"""
-        try:
+        with self.transaction():
             dataset = self.db.query(DatasetHistory).filter(
                 DatasetHistory.id == dataset_id
             ).first()
@@ -248,28 +284,18 @@ class DatabaseService:
             if dataset:
                 dataset.last_used = datetime.utcnow()
                 dataset.usage_count += 1
-                self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
 
     def cleanup_old_datasets(self, days: int = 30):
         """Remove datasets older than specified days (except favorites)"""
-        try:
+        with self.transaction():
             cutoff_date = datetime.utcnow() - timedelta(days=days)
-            old_datasets = self.db.query(DatasetHistory).filter(
-                DatasetHistory.last_used < cutoff_date,
-                DatasetHistory.is_favorite == False
-            ).all()
-            
-            for dataset in old_datasets:
-                self.db.delete(dataset)
-            
-            self.db.commit()
-            return len(old_datasets)
-        except Exception as e:
-            self.db.rollback()
-            raise e 
+            result = self.db.execute(
+                delete(DatasetHistory).where(
+                    DatasetHistory.last_used < cutoff_date,
+                    DatasetHistory.is_favorite == False
+                )
+            )
+        return result.rowcount
 
     def delete_dataset_from_history(self, dataset_id: int) -> str:
         """Delete a dataset from history and return its file path for deletion"""
@@ -280,13 +306,12 @@ class DatabaseService:
             if dataset:
                 print(f"DEBUG: Found dataset in DB for delete: id={dataset_id}, filename={dataset.filename}")
                 file_path = dataset.filename
-                self.db.delete(dataset)
-                self.db.commit()
+                with self.transaction():
+                    self.db.delete(dataset)
                 print(f"DEBUG: Deleted dataset from DB: id={dataset_id}")
                 return file_path
             print(f"DEBUG: Dataset id={dataset_id} not found in DB for delete")
             return None
         except Exception as e:
             print(f"DEBUG: Exception in delete_dataset_from_history: {e}")
-            self.db.rollback()
             raise e 
\ No newline at end of file
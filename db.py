@@ -1,7 +1,7 @@
 # db.py
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from dotenv import load_dotenv
 
 load_dotenv()  # Load values from .env
@@ -13,11 +13,26 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "mydatabase")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")  # Will be 'postgres' in Docker
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+# Connection pool sizing (tune per deployment)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds before a connection is replaced
+
 # Compose connection URL
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+DATABASE_URL = f"postgresql+psycopg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
 # SQLAlchemy setup
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,  # Drop dead connections before handing them out
+    pool_recycle=DB_POOL_RECYCLE
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# One session per thread, shared by every DatabaseService used while handling a request
+SessionScoped = scoped_session(SessionLocal)
 
 Base = declarative_base()
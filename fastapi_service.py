@@ -1,16 +1,46 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import List, Annotated, Optional
+from contextlib import asynccontextmanager
+import logging
+import os
+import threading
 import traceback
 import time
-import pandas as pd
+import orjson
+from cachetools import TTLCache
 
-from llm_service import get_llm_chain, generate_code_with_llm
+from db import SessionLocal, engine
+from llm_service import get_llm_chain, generate_code_with_llm, stream_code_with_llm
 from database_service import DatabaseService
 
-app = FastAPI()
+log = logging.getLogger("api")
+
+# Short-lived cache so frequent /statistics/ polling doesn't re-run the counts
+STATISTICS_CACHE_TTL = 5  # seconds
+_statistics_cache = TTLCache(maxsize=1, ttl=STATISTICS_CACHE_TTL)
+_statistics_cache_lock = threading.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Endpoints draw their sessions from one process-wide factory; pooled connections are closed on shutdown
+    app.state.session_factory = SessionLocal
+    yield
+    engine.dispose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+def get_db_service(request: Request):
+    """One DatabaseService per request, backed by a session from the app's factory"""
+    db = request.app.state.session_factory()
+    try:
+        yield DatabaseService(db)
+    finally:
+        db.close()
+
+DBService = Annotated[DatabaseService, Depends(get_db_service)]
 
 class LLMRequest(BaseModel):
     columns: List[str]
@@ -34,11 +64,11 @@ except Exception as e:
     raise RuntimeError("LLM initialization failed") from e
 
 @app.post("/generate_code/")
-async def generate_code(request: LLMRequest):
-    start_time = time.time()
+def generate_code(request: LLMRequest, db_service: DBService):
+    start_time = time.perf_counter()
     
     try:
-        print("📨 Received request:", request.dict())
+        log.debug("📨 Received request: %s", request)
         
         # Generate code from LLM
         code = generate_code_with_llm(
@@ -46,18 +76,17 @@ async def generate_code(request: LLMRequest):
             columns=request.columns,
             question=request.question
         )
-        print("✅ Generated code:\n", code)
+        log.debug("✅ Generated code:\n%s", code)
 
         # Log query to database
-        with DatabaseService() as db_service:
-            query_id = db_service.log_query(
-                question=request.question,
-                generated_code=code,
-                dataset_name=request.dataset_name,
-                dataset_columns=request.columns
-            )
-
-        execution_time = time.time() - start_time
+        query_id = db_service.log_query(
+            question=request.question,
+            generated_code=code,
+            dataset_name=request.dataset_name,
+            dataset_columns=request.columns
+        )
+
+        execution_time = time.perf_counter() - start_time
         
         return {
             "generated_code": code,
@@ -66,48 +95,90 @@ async def generate_code(request: LLMRequest):
         }
 
     except Exception as e:
-        print("❌ Error in /generate_code:")
-        traceback.print_exc()
-        return JSONResponse(
+        log.exception("❌ Error in /generate_code")
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"LLM failed: {str(e)}"}
         )
 
+def _sse(event: str, payload: dict) -> str:
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {orjson.dumps(payload).decode()}\n\n"
+
+@app.post("/generate_code_stream/")
+def generate_code_stream(request: LLMRequest):
+    """
+    Same as /generate_code/ but streamed as server-sent events: "chunk" events carry raw
+    LLM output as it arrives, and a final "done" event carries the cleaned code and query id.
+    """
+    def events():
+        start_time = time.perf_counter()
+        try:
+            code = None
+            for kind, text in stream_code_with_llm(llm_chain, request.columns, request.question):
+                if kind == "chunk":
+                    yield _sse("chunk", {"text": text})
+                else:
+                    code = text
+            
+            # Log query to database; the client already has the code, so commit inline
+            db = app.state.session_factory()
+            try:
+                query_id = DatabaseService(db).log_query(
+                    question=request.question,
+                    generated_code=code,
+                    dataset_name=request.dataset_name,
+                    dataset_columns=request.columns
+                )
+            finally:
+                db.close()
+            
+            yield _sse("done", {
+                "generated_code": code,
+                "query_id": query_id,
+                "execution_time": time.perf_counter() - start_time
+            })
+        except Exception as e:
+            log.exception("❌ Error in /generate_code_stream")
+            yield _sse("error", {"error": f"LLM failed: {str(e)}"})
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+_HEALTH_BODY = orjson.dumps({"status": "ok"})
+
 @app.get("/health/")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    # Pre-serialized and async: load balancer probes skip encoding and the threadpool
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 @app.post("/store_dataset/")
-async def store_dataset(request: DatasetRequest):
+def store_dataset(request: DatasetRequest, db_service: DBService):
     """Store dataset information in the database"""
     try:
-        with DatabaseService() as db_service:
-            dataset_id = db_service.store_dataset(
-                name=request.name,
-                filename=request.filename,
-                columns=request.columns,
-                row_count=request.row_count
-            )
+        dataset_id = db_service.store_dataset(
+            name=request.name,
+            filename=request.filename,
+            columns=request.columns,
+            row_count=request.row_count
+        )
         return {"dataset_id": dataset_id, "message": "Dataset stored successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/recent_queries/")
-async def get_recent_queries(limit: int = 10):
+def get_recent_queries(db_service: DBService, limit: int = 10):
     """Get recent queries from the database"""
     try:
-        with DatabaseService() as db_service:
-            queries = db_service.get_recent_queries(limit=limit)
+        queries = db_service.get_recent_queries(limit=limit)
         return {"queries": queries}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/query/{query_id}")
-async def get_query_details(query_id: int):
+def get_query_details(query_id: int, db_service: DBService):
     """Get detailed information about a specific query"""
     try:
-        with DatabaseService() as db_service:
-            query_details = db_service.get_query_details(query_id)
+        query_details = db_service.get_query_details(query_id)
         if not query_details:
             raise HTTPException(status_code=404, detail="Query not found")
         return query_details
@@ -117,115 +188,114 @@ async def get_query_details(query_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/datasets/")
-async def get_datasets():
+def get_datasets(db_service: DBService):
     """Get all datasets from the database"""
     try:
-        with DatabaseService() as db_service:
-            datasets = db_service.get_datasets()
+        datasets = db_service.get_datasets()
         return {"datasets": datasets}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/statistics/")
-async def get_statistics():
+def get_statistics(db_service: DBService):
     """Get database statistics"""
     try:
-        with DatabaseService() as db_service:
+        with _statistics_cache_lock:
+            stats = _statistics_cache.get("stats")
+        if stats is None:
             stats = db_service.get_statistics()
+            with _statistics_cache_lock:
+                _statistics_cache["stats"] = stats
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/update_execution/{query_id}")
-async def update_execution(
+def update_execution(
     query_id: int,
+    db_service: DBService,
     execution_output: Optional[str] = None,
     success: bool = True,
     execution_time: Optional[float] = None
 ):
     """Update query execution results"""
     try:
-        with DatabaseService() as db_service:
-            db_service.update_query_execution(
-                query_id=query_id,
-                execution_output=execution_output,
-                success=success,
-                execution_time=execution_time
-            )
+        db_service.update_query_execution(
+            query_id=query_id,
+            execution_output=execution_output,
+            success=success,
+            execution_time=execution_time
+        )
         return {"message": "Execution updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/dataset_history/")
-async def get_dataset_history():
+def get_dataset_history(db_service: DBService):
     """Get recent dataset history"""
     try:
-        with DatabaseService() as db_service:
-            history = db_service.get_dataset_history(limit=10)
+        history = db_service.get_dataset_history(limit=10)
         return {"datasets": history}
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to get dataset history: {str(e)}"}
         )
 
 @app.get("/favorites/")
-async def get_favorites():
+def get_favorites(db_service: DBService):
     """Get favorite datasets"""
     try:
-        with DatabaseService() as db_service:
-            favorites = db_service.get_favorites()
+        favorites = db_service.get_favorites()
         return {"favorites": favorites}
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to get favorites: {str(e)}"}
         )
 
 @app.post("/toggle_favorite/{dataset_id}")
-async def toggle_favorite(dataset_id: int):
+def toggle_favorite(dataset_id: int, db_service: DBService):
     """Toggle favorite status of a dataset"""
     try:
-        with DatabaseService() as db_service:
-            is_favorite = db_service.toggle_favorite(dataset_id)
+        is_favorite = db_service.toggle_favorite(dataset_id)
         return {"is_favorite": is_favorite}
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to toggle favorite: {str(e)}"}
         )
 
 @app.post("/cleanup_datasets/")
-async def cleanup_datasets():
+def cleanup_datasets(db_service: DBService):
     """Clean up old datasets (except favorites)"""
     try:
-        with DatabaseService() as db_service:
-            removed_count = db_service.cleanup_old_datasets(days=30)
+        removed_count = db_service.cleanup_old_datasets(days=30)
         return {"removed_count": removed_count, "message": f"Removed {removed_count} old datasets"}
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to cleanup datasets: {str(e)}"}
         )
 
 @app.delete("/delete_dataset/{dataset_id}")
-async def delete_dataset(dataset_id: int):
+def delete_dataset(dataset_id: int, db_service: DBService):
     """Delete a dataset from history and remove its file. If not found, return 200 OK (idempotent)."""
-    import os
     try:
-        with DatabaseService() as db_service:
-            file_path = db_service.delete_dataset_from_history(dataset_id)
+        file_path = db_service.delete_dataset_from_history(dataset_id)
         if file_path:
             print(f"DEBUG: Deleted dataset id={dataset_id}, file_path={file_path}")
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass  # Already removed, e.g. by a concurrent delete
             return {"message": "Dataset deleted successfully"}
         else:
             print(f"DEBUG: Dataset id={dataset_id} not found in DB (already deleted)")
             return {"message": "Dataset not found (already deleted)"}
     except Exception as e:
         print(f"DEBUG: Exception in delete_dataset: {e}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to delete dataset: {str(e)}"}
         )
@@ -5,4 +5,8 @@ from db import engine
 
 if __name__ == "__main__":
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables, so add any indexes they are missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("✅ Database tables created.")
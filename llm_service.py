@@ -1,29 +1,71 @@
 
 import os
+import re
+import time
+import threading
+import functools
 import google.generativeai as genai
+from cachetools import TTLCache
 
-def get_available_models():
+# Rewrites for inplace operations in generated code (fillna, replace, dropna)
+_INPLACE_PATTERNS = [
+    (re.compile(pattern), replacement)
+    for pattern, replacement in [
+        (r"(df\[[^\]]+\])\.fillna\(([^,]+),\s*inplace=True\)", r"\1 = \1.fillna(\2)"),
+        (r"(df\[[^\]]+\])\.replace\(([^,]+),\s*inplace=True\)", r"\1 = \1.replace(\2)"),
+        (r"(df\[[^\]]+\])\.dropna\(([^)]*),?\s*inplace=True\)", r"\1 = \1.dropna(\1)")
+    ]
+]
+
+# Optional opening fence and "python" tag, the code body, then an optional closing fence
+_FENCE_RE = re.compile(r"^\s*(?:```)?(?:python\b)?(.*?)(?:```)?\s*$", re.DOTALL)
+
+# Generated code cache, keyed on (chain, column set, normalized question), to skip repeat LLM calls
+LLM_CACHE_TTL = 86400  # seconds
+_llm_cache = TTLCache(maxsize=1024, ttl=LLM_CACHE_TTL)
+_llm_cache_lock = threading.Lock()
+
+# Model list cache, keyed on API key, so startup and retries don't re-list models
+MODELS_CACHE_TTL = 600  # seconds
+_models_cache = {}
+_models_cache_lock = threading.Lock()
+
+def get_available_models(force_refresh=False):
     """
     Get list of available Gemini models that support content generation.
     This ensures we always use a valid model.
+    Results are cached for MODELS_CACHE_TTL seconds unless force_refresh is set.
     """
+    api_key = os.getenv("GOOGLE_API_KEY")
+    with _models_cache_lock:
+        cached = _models_cache.get(api_key)
+        if not force_refresh and cached and time.monotonic() - cached[0] < MODELS_CACHE_TTL:
+            return list(cached[1])
+    
     try:
         available = []
         for model in genai.list_models():
             if 'generateContent' in model.supported_generation_methods:
                 available.append(model.name.replace('models/', ''))
-        return available
     except Exception as e:
         print(f"Warning: Could not fetch available models: {e}")
         return []
+    
+    with _models_cache_lock:
+        _models_cache[api_key] = (time.monotonic(), tuple(available))
+    return available
 
-def select_best_model(preferred_model=None):
+def select_best_model(preferred_model=None, force_refresh=False):
     """
     Automatically select the best available model with fallback strategy.
     Priority order: User preference > Latest stable > Flash > Pro > Any available
     """
-    available_models = get_available_models()
-    
+    available_models = get_available_models(force_refresh=force_refresh)
+    return _select_from_available(preferred_model, tuple(available_models))
+
+@functools.lru_cache(maxsize=32)
+def _select_from_available(preferred_model, available_models):
+    """Pick a model from a given list of available models (memoized on the inputs)"""
     if not available_models:
         # Fallback to common model names if API call fails
         print("⚠️ Warning: Using fallback model list")
@@ -170,40 +212,92 @@ REMEMBER:
     # Return both the template and model name for use in generate_code_with_llm
     return template, model_name
 
-def generate_code_with_llm(chain, columns, question):
-    import re
+@functools.lru_cache(maxsize=8)
+def _split_template(template):
+    """Split a prompt template around {columns} and {question}, unescaping literal braces"""
+    prefix, rest = template.split("{columns}")
+    middle, suffix = rest.split("{question}")
+    unescape = lambda part: part.replace("{{", "{").replace("}}", "}")
+    return unescape(prefix), unescape(middle), unescape(suffix)
+
+@functools.lru_cache(maxsize=8)
+def _get_model(model_name):
+    """Reuse one GenerativeModel (and its client) per model name"""
+    return genai.GenerativeModel(model_name)
+
+@functools.lru_cache(maxsize=64)
+def _prompt_for_columns(template, columns):
+    """Prompt text up to the question slot, rendered once per column set"""
+    prefix, middle, _ = _split_template(template)
+    return prefix + ", ".join(columns) + middle
+
+def _render_prompt(template, columns, question):
+    """Equivalent to template.format(...); only the question is filled in per request"""
+    suffix = _split_template(template)[2]
+    return _prompt_for_columns(template, tuple(columns)) + question + suffix
+
+def clean_llm_output(llm_output):
+    """Turn raw LLM text into runnable code: strip fences and fix known artifacts"""
+    # Clean output: remove markdown/code fences, leading/trailing whitespace, and "python" prefix
+    cleaned_code = _FENCE_RE.match(llm_output).group(1).strip()
+
+    # Keep plt.show() for Streamlit display, but also save the plot
+    if "plt.savefig('output.png')" not in cleaned_code and "plt.show()" in cleaned_code:
+        cleaned_code = cleaned_code.replace("plt.show()", "plt.savefig('output.png')\nplt.show()")
+    elif "plt.savefig('output.png')" in cleaned_code and "plt.show()" not in cleaned_code:
+        cleaned_code = cleaned_code.replace("plt.savefig('output.png')", "plt.savefig('output.png')\nplt.show()")
+
+    # Fix common formatting artifacts (optional, add more as needed)
+    cleaned_code = cleaned_code.replace(".2f} tons", "} tons")
+
+    # Fix inplace operations (fillna, replace, dropna)
+    for pattern, replacement in _INPLACE_PATTERNS:
+        cleaned_code = pattern.sub(replacement, cleaned_code)
+
+    return cleaned_code
+
+def _llm_cache_key(chain, columns, question):
+    """Generated code cache key: the chain (template, model), the column set and the
+    question with whitespace collapsed; case is kept since it can matter in literals"""
+    return (tuple(chain), tuple(sorted(columns)), " ".join(question.split()))
+
+def _cached_code(cache_key):
+    with _llm_cache_lock:
+        return _llm_cache.get(cache_key)
+
+def _store_code(cache_key, llm_output):
+    """Clean the raw model output, cache it and return the cleaned code"""
+    if not llm_output:
+        raise Exception("Failed to generate code - no output received")
+    cleaned_code = clean_llm_output(llm_output)
+    with _llm_cache_lock:
+        _llm_cache[cache_key] = cleaned_code
+    return cleaned_code
+
+def _generate_content(chain, columns, question, stream=False):
+    """Call Gemini with the chain's model, falling back to an auto-selected model if it is not found"""
     template, model_name = chain
-    
-    # Try with the specified model, fallback to auto-select if it fails
+    prompt_str = _render_prompt(template, columns, question)
     max_retries = 2
-    last_error = None
-    llm_output = None
     
     for attempt in range(max_retries):
         try:
-            # Format the prompt
-            prompt_str = template.format(columns=", ".join(columns), question=question)
-            
-            # Call Gemini
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt_str)
-            llm_output = response.text
-            
-            # If we get here, it worked!
-            break
+            # With stream=True the first chunk is fetched here, so a missing model fails before anything is yielded
+            return _get_model(model_name).generate_content(prompt_str, stream=stream)
             
         except Exception as e:
-            last_error = e
             error_msg = str(e)
             
             # Check if it's a model not found error
             if "404" in error_msg or "not found" in error_msg.lower():
                 print(f"⚠️ Model '{model_name}' failed (attempt {attempt + 1}/{max_retries})")
                 
+                _get_model.cache_clear()
+                
                 if attempt < max_retries - 1:
                     # Try to auto-select a different model
                     print("🔄 Attempting to auto-select a working model...")
-                    model_name = select_best_model()
+                    model_name = select_best_model(force_refresh=True)
                     print(f"🔄 Retrying with model: {model_name}")
                     continue
                 else:
@@ -213,47 +307,34 @@ def generate_code_with_llm(chain, columns, question):
                 # For other errors, raise immediately
                 print("LLM Error:", e)
                 raise e
+
+def generate_code_with_llm(chain, columns, question):
+    cache_key = _llm_cache_key(chain, columns, question)
+    cached_code = _cached_code(cache_key)
+    if cached_code is not None:
+        return cached_code
     
-    if not llm_output:
-        if last_error:
-            raise last_error
-        else:
-            raise Exception("Failed to generate code - no output received")
-    
-    # Clean output: remove markdown/code fences, leading/trailing whitespace, and "python" prefix
-    cleaned_code = llm_output.strip()
-    
-    # Remove markdown code blocks
-    if cleaned_code.startswith("```python"):
-        cleaned_code = cleaned_code[9:]  # Remove "```python"
-    elif cleaned_code.startswith("```"):
-        cleaned_code = cleaned_code[3:]  # Remove "```"
+    response = _generate_content(chain, columns, question)
+    return _store_code(cache_key, response.text)
+
+def stream_code_with_llm(chain, columns, question):
+    """
+    Stream code generation from Gemini.
+    Yields ("chunk", text) for each piece of raw output as it arrives, then a final
+    ("code", cleaned_code) with the same value generate_code_with_llm would return.
+    """
+    cache_key = _llm_cache_key(chain, columns, question)
+    cached_code = _cached_code(cache_key)
+    if cached_code is not None:
+        yield "chunk", cached_code
+        yield "code", cached_code
+        return
     
-    if cleaned_code.endswith("```"):
-        cleaned_code = cleaned_code[:-3]  # Remove trailing "```"
+    response = _generate_content(chain, columns, question, stream=True)
     
-    # Remove "python" prefix if it exists
-    if cleaned_code.startswith("python"):
-        cleaned_code = cleaned_code[6:].strip()
+    parts = []
+    for chunk in response:
+        parts.append(chunk.text)
+        yield "chunk", chunk.text
     
-    cleaned_code = cleaned_code.strip()
-
-    # Keep plt.show() for Streamlit display, but also save the plot
-    if "plt.savefig('output.png')" not in cleaned_code and "plt.show()" in cleaned_code:
-        cleaned_code = cleaned_code.replace("plt.show()", "plt.savefig('output.png')\nplt.show()")
-    elif "plt.savefig('output.png')" in cleaned_code and "plt.show()" not in cleaned_code:
-        cleaned_code = cleaned_code.replace("plt.savefig('output.png')", "plt.savefig('output.png')\nplt.show()")
-
-    # Fix common formatting artifacts (optional, add more as needed)
-    cleaned_code = cleaned_code.replace(".2f} tons", "} tons")
-
-    # Fix inplace operations (fillna, replace, dropna)
-    inplace_patterns = [
-        (r"(df\[[^\]]+\])\.fillna\(([^,]+),\s*inplace=True\)", r"\1 = \1.fillna(\2)"),
-        (r"(df\[[^\]]+\])\.replace\(([^,]+),\s*inplace=True\)", r"\1 = \1.replace(\2)"),
-        (r"(df\[[^\]]+\])\.dropna\(([^)]*),?\s*inplace=True\)", r"\1 = \1.dropna(\1)")
-    ]
-    for pattern, replacement in inplace_patterns:
-        cleaned_code = re.sub(pattern, replacement, cleaned_code)
-
-    return cleaned_code
\ No newline at end of file
+    yield "code", _store_code(cache_key, "".join(parts))
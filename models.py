@@ -1,6 +1,6 @@
 # models.py
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, Boolean, Index
 from datetime import datetime
 from db import Base
 
@@ -13,7 +13,7 @@ class QueryLog(Base):
     execution_output = Column(Text, nullable=True)
     execution_success = Column(Integer, default=1)  # 1 for success, 0 for failure
     execution_time = Column(Float, nullable=True)  # Time taken to execute
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     dataset_name = Column(String, nullable=True)
     dataset_columns = Column(JSON, nullable=True)  # Store columns as JSON
 
@@ -32,21 +32,25 @@ class AnalysisResult(Base):
     __tablename__ = "analysis_results"
 
     id = Column(Integer, primary_key=True, index=True)
-    query_log_id = Column(Integer, nullable=False)
+    query_log_id = Column(Integer, nullable=False, index=True)
     result_type = Column(String, nullable=False)  # 'text', 'plot', 'statistics'
     result_data = Column(Text, nullable=True)
     plot_filename = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
 class DatasetHistory(Base):
     __tablename__ = "dataset_history"
+    __table_args__ = (
+        # Serves get_favorites and cleanup_old_datasets (filter on is_favorite, order/filter on last_used)
+        Index("ix_dh_fav_lastused", "is_favorite", "last_used"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    filename = Column(String, nullable=False)  # Original filename
+    filename = Column(String, nullable=False, index=True)  # Original filename
     columns = Column(JSON, nullable=True)  # Store columns as JSON
     row_count = Column(Integer, nullable=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
-    last_used = Column(DateTime, default=datetime.utcnow)
+    last_used = Column(DateTime, default=datetime.utcnow, index=True)
     is_favorite = Column(Boolean, default=False)
     usage_count = Column(Integer, default=1)  # Track how often it's used